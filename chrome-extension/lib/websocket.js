@@ -209,23 +209,46 @@ class WebSocketManager {
                 return;
             }
 
+            // 服务器以二进制帧发送 orjson 序列化的 JSON，先还原为文本再解析
+            if (event.data instanceof Blob) {
+                event.data.text()
+                    .then(text => this.processRawMessage(text, event))
+                    .catch(error => {
+                        console.error('读取二进制WebSocket消息失败:', error);
+                        this.emit('error', { error, source: 'message_handler' });
+                    });
+                return;
+            }
+
+            this.processRawMessage(event.data, event);
+
+        } catch (error) {
+            console.error('处理WebSocket消息时发生内部错误:', error);
+            this.emit('error', { error, source: 'message_handler' });
+        }
+    }
+
+    /**
+     * 解析并分发一条原始文本消息
+     */
+    processRawMessage(rawData, event) {
+        try {
             let message;
             try {
-                message = JSON.parse(event.data);
+                message = JSON.parse(rawData);
             } catch (parseError) {
-                console.error('解析WebSocket消息失败:', parseError, '原始数据:', event.data);
-                this.emit('message', { rawData: event.data, parseError: true });
+                console.error('解析WebSocket消息失败:', parseError, '原始数据:', rawData);
+                this.emit('message', { rawData: rawData, parseError: true });
                 return;
             }
 
-            // 处理认证响应
-            if (message && typeof message === 'object' && message.type === 'auth_response') {
-                this.handleAuthResponse(message);
+            // 服务器可能把同一时刻的多条消息合并为一帧（{"batch": [...]}），逐条拆包处理
+            if (message && typeof message === 'object' && Array.isArray(message.batch)) {
+                message.batch.forEach(item => this.dispatchMessage(item, event));
                 return;
             }
 
-            // 触发通用消息事件
-            this.emit('message', { data: message, originalEvent: event });
+            this.dispatchMessage(message, event);
 
         } catch (error) {
             console.error('处理WebSocket消息时发生内部错误:', error);
@@ -233,6 +256,20 @@ class WebSocketManager {
         }
     }
 
+    /**
+     * 分发单条已解析的消息
+     */
+    dispatchMessage(message, event) {
+        // 处理认证响应
+        if (message && typeof message === 'object' && message.type === 'auth_response') {
+            this.handleAuthResponse(message);
+            return;
+        }
+
+        // 触发通用消息事件
+        this.emit('message', { data: message, originalEvent: event });
+    }
+
     /**
      * 处理认证响应
      */
@@ -7,6 +7,7 @@ class Settings(BaseSettings):
     debug: bool = False
     connect_id: str = "browser-tools"
     websocket_timeout: float = 5.0  # WebSocket消息响应超时时间（秒）
+    max_inflight_per_connection: int = 32  # 单个浏览器连接允许的最大在途请求数
 
     class Config:
         env_file = ".env"  # 同时支持系统变量和.env文件
@@ -3,6 +3,8 @@
 提供WebSocket连接相关的装饰器函数，用于统一处理连接验证等逻辑
 """
 
+import asyncio
+import hmac
 from functools import wraps
 from fastapi import WebSocket
 from typing import Optional, Callable, Any
@@ -11,6 +13,13 @@ from logger import get_logger
 
 logger = get_logger(__name__)
 
+# 启动时绑定一次，握手热路径上不再走 pydantic 的属性访问；
+# 预编码为 bytes：compare_digest 对含非 ASCII 字符的 str 会抛 TypeError
+_EXPECTED_CONN_ID = settings.connect_id.encode("utf-8")
+
+# 持有被拒绝连接的 close 任务引用，防止任务在完成前被垃圾回收
+_close_tasks: set = set()
+
 def validate_connect_id(func: Callable) -> Callable:
     """验证WebSocket连接的connect_id装饰器
     
@@ -24,9 +33,14 @@ def validate_connect_id(func: Callable) -> Callable:
     """
     @wraps(func)
     async def wrapper(websocket: WebSocket, conn_id: Optional[str] = None, *args: Any, **kwargs: Any):
-        # 验证connect_id是否匹配
-        if conn_id != settings.connect_id:
-            await websocket.close(code=4001, reason="Invalid connect_id")
+        # 验证connect_id是否匹配（常数时间比较，避免通过时序泄露长度信息）
+        if not hmac.compare_digest((conn_id or "").encode("utf-8"), _EXPECTED_CONN_ID):
+            # 关闭握手尽力而为即可，不等待对端确认，立即释放接受循环
+            close_task = asyncio.create_task(
+                websocket.close(code=4001, reason="Invalid connect_id")
+            )
+            _close_tasks.add(close_task)
+            close_task.add_done_callback(_close_tasks.discard)
             logger.warning(f"WebSocket连接被拒绝：无效的connect_id [{conn_id}]")
             return
             
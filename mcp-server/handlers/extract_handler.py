@@ -8,20 +8,127 @@ MCP 工具 - 内容提取指令处理器
 
 import asyncio
 import logging
-import json
+import orjson
 import uuid
 import base64
+import binascii
 from datetime import datetime
 from pathlib import Path
 from bs4 import BeautifulSoup
 import re
 import os
 import io
+import concurrent.futures
 from PIL import Image
-import requests
+import aiohttp
 
 logger = logging.getLogger('extract_handler')
 
+# 文件名清理用的正则，预编译为模块级常量，避免每次调用的缓存查找
+_UNSAFE_CHARS_RE = re.compile(r'[\\/*?:"<>|]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_UNDERSCORES_RE = re.compile(r'_+')
+
+# 所有 extract 命令共享一个 aiohttp 会话，跨命令复用 keep-alive 连接，
+# 摊薄 DNS 解析和 TCP+TLS 握手成本
+_session = None
+_session_lock = None
+
+
+async def _get_session():
+    """获取共享的 aiohttp 会话（懒加载）
+
+    Returns:
+        aiohttp.ClientSession: 模块级共享的 HTTP 会话
+    """
+    global _session, _session_lock
+    if _session is not None and not _session.closed:
+        return _session
+    if _session_lock is None:
+        _session_lock = asyncio.Lock()
+    async with _session_lock:
+        # 加锁后二次检查，避免并发首次调用时重复创建会话
+        if _session is None or _session.closed:
+            _session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=64,
+                    limit_per_host=16,
+                    keepalive_timeout=60,
+                    ttl_dns_cache=600,
+                    enable_cleanup_closed=True
+                )
+            )
+    return _session
+
+
+async def close_session():
+    """关闭共享的 aiohttp 会话（服务关闭时调用）"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+# 图片验证/转换/编码是 CPU 密集操作，放到进程池执行，避免阻塞事件循环
+_image_executor = None
+
+
+def _get_image_executor():
+    """获取用于图片处理的进程池（懒加载）
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: 共享的进程池
+    """
+    global _image_executor
+    if _image_executor is None:
+        _image_executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=os.cpu_count()
+        )
+    return _image_executor
+
+
+def _decode_and_save(encoded, path, img_format):
+    """解码 base64 数据并保存图片
+
+    base64 解码和图片解码/编码都是 CPU 密集操作，整体放在进程池中
+    执行，事件循环只传递原始的 base64 字符串。
+
+    data URL 头部已声明了 MIME 类型，这里不再先 verify 再重新打开
+    （那样要完整解码两次），而是直接打开并保存；损坏的数据会在
+    open/save 阶段抛出异常，由调用方按验证失败处理
+
+    在进程池中执行，因此必须是模块级函数（可 pickle）
+
+    Args:
+        encoded (str): base64 编码的图片数据
+        path (str): 保存路径
+        img_format (str): 图片格式（如 jpg、png、svg）
+    """
+    binary_data = base64.b64decode(encoded)
+    if img_format == 'svg':
+        with open(path, 'wb') as f:
+            f.write(binary_data)
+        return
+    img = Image.open(io.BytesIO(binary_data))
+    # 转换为RGB模式（处理RGBA等情况）
+    if img.mode in ['RGBA', 'LA'] and img_format == 'jpg':
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        img = background
+    img.save(path, format=img_format.upper())
+
+
+def _verify_image_file(path):
+    """验证磁盘上的图片文件完整性
+
+    在进程池中执行，因此必须是模块级函数（可 pickle）
+
+    Args:
+        path (str): 图片文件路径
+    """
+    img = Image.open(path)
+    img.verify()  # 验证图片完整性
+
 
 class ExtractHandler:
     """内容提取指令处理器类"""
@@ -35,9 +142,11 @@ class ExtractHandler:
         self.server = server
         self.protocol = server.protocol
         self.output_dir = server.output_dir / 'extracts'
-        self.output_dir.mkdir(exist_ok=True)
         self.image_dir = self.output_dir / 'images'
-        self.image_dir.mkdir(exist_ok=True)
+        # 一次调用创建整条目录链，替代逐级 mkdir
+        os.makedirs(self.image_dir, exist_ok=True)
+        # 已确认存在的提取目录，重复提取时跳过 stat/mkdir 系统调用
+        self._known_dirs = set()
 
     async def handle_command(self, client_id, task):
         """处理内容提取指令
@@ -121,36 +230,52 @@ class ExtractHandler:
 
             # 创建安全的文件名
             safe_title = self._create_safe_filename(title or url)
-            timestamp_str = datetime.fromisoformat(timestamp).strftime('%Y%m%d_%H%M%S')
+            # timestamp 本身就是 ISO-8601（YYYY-MM-DDTHH:MM:SS...），直接切片拼出
+            # YYYYMMDD_HHMMSS，省去 datetime 解析和格式化；格式异常时回退到当前时间
+            try:
+                timestamp_str = timestamp[:19].replace('-', '').replace(':', '').replace('T', '_')
+            except (TypeError, AttributeError):
+                timestamp_str = datetime.now().strftime('%Y%m%d_%H%M%S')
             filename = f"{timestamp_str}_{safe_title[:50]}"
 
-            # 创建输出目录结构
+            # 创建输出目录结构（assets 连同上级 extract_dir 一次创建，
+            # 已创建过的目录直接跳过）
             extract_dir = self.output_dir / filename
-            extract_dir.mkdir(exist_ok=True)
             assets_dir = extract_dir / 'assets'
-            assets_dir.mkdir(exist_ok=True)
+            if assets_dir not in self._known_dirs:
+                os.makedirs(assets_dir, exist_ok=True)
+                self._known_dirs.add(assets_dir)
 
             # 保存提取结果
             output_path = extract_dir / f"content.json"
             html_path = extract_dir / f"content.html"
             text_path = extract_dir / f"content.txt"
 
-            # 处理图片（如果有）
+            # 处理图片（如果有），各图片相互独立，并发处理以缩短总耗时
             images = result.get('images', [])
             processed_images = []
 
-            for i, img in enumerate(images):
-                img_src = img.get('src', '')
-                if not img_src:
-                    continue
-
-                # 如果是 data URL，解码并保存
-                if img_src.startswith('data:image/'):
-                    img_path = await self._save_data_url_image(img_src, assets_dir / f"image_{i}")
-                else:
-                    # 下载远程图片
-                    img_path = await self._download_image(img_src, assets_dir / f"image_{i}")
+            # 限制并发度，避免对远程主机发起过多请求
+            semaphore = asyncio.Semaphore(16)
+
+            async def _process_image(index, img_src):
+                """保存单张图片，返回保存后的本地路径（失败返回 None）"""
+                async with semaphore:
+                    # 如果是 data URL，解码并保存；否则下载远程图片
+                    if img_src.startswith('data:image/'):
+                        return await self._save_data_url_image(img_src, assets_dir / f"image_{index}")
+                    return await self._download_image(img_src, assets_dir / f"image_{index}")
+
+            pending_images = [(i, img) for i, img in enumerate(images) if img.get('src', '')]
+            img_paths = await asyncio.gather(
+                *(_process_image(i, img['src']) for i, img in pending_images),
+                return_exceptions=True
+            )
 
+            for (_, img), img_path in zip(pending_images, img_paths):
+                if isinstance(img_path, BaseException):
+                    logger.error(f"处理图片失败 {img.get('src', '')}: {img_path}")
+                    continue
                 if img_path:
                     img['local_path'] = str(img_path.relative_to(self.server.output_dir))
                     img['filename'] = img_path.name
@@ -170,6 +295,16 @@ class ExtractHandler:
                     })
 
             # 构建结构化内容
+            # 大体积的 html/text 正文单独落盘（content.html / content.txt），
+            # JSON 中只保留文件名引用，避免序列化时再复制一份大字符串
+            html_content = content.get('html', '')
+            text_content = content.get('text', '')
+            content_meta = {k: v for k, v in content.items() if k not in ('html', 'text')}
+            if html_content:
+                content_meta['html_file'] = html_path.name
+            if text_content:
+                content_meta['text_file'] = text_path.name
+
             structured_content = {
                 'url': url,
                 'title': title,
@@ -180,46 +315,53 @@ class ExtractHandler:
                     'author': page_info.get('author', ''),
                     'favicon': page_info.get('favicon', '')
                 },
-                'content': content,
+                'content': content_meta,
                 'images': processed_images,
                 'links': processed_links,
                 'stats': {
                     'image_count': len(processed_images),
                     'link_count': len(processed_links),
-                    'text_length': len(content.get('text', '')) if isinstance(content.get('text'), str) else 0
+                    'text_length': len(text_content) if isinstance(text_content, str) else 0
                 }
             }
 
-            # 保存 JSON 结果
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(structured_content, f, ensure_ascii=False, indent=2)
+            # 保存 JSON 结果（orjson 直接输出 UTF-8 字节，比 json.dump 快且省内存）
+            with open(output_path, 'wb') as f:
+                f.write(orjson.dumps(
+                    structured_content,
+                    option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+                ))
 
             # 保存 HTML 内容
-            html_content = content.get('html', '')
             if html_content:
-                # 处理HTML中的相对路径
-                soup = BeautifulSoup(html_content, 'html.parser')
-                
+                # 处理HTML中的相对路径（lxml 为 C 实现，比 html.parser 快得多）
+                soup = BeautifulSoup(html_content, 'lxml')
+
+                # src -> 已处理图片 的映射，把逐标签的线性扫描变成 O(1) 查找
+                src_to_img = {
+                    img['src']: img
+                    for img in processed_images
+                    if img.get('src') and 'local_path' in img
+                }
+
                 # 处理图片路径
                 for img_tag in soup.find_all('img'):
                     src = img_tag.get('src', '')
                     if not src:
                         continue
-                        
+
                     # 查找对应的已处理图片
-                    for img in processed_images:
-                        if img.get('src') == src and 'local_path' in img:
-                            # 更新为本地路径
-                            img_tag['src'] = f"assets/{img['filename']}"
-                            img_tag['data-original-src'] = src
-                            break
-                
+                    img = src_to_img.get(src)
+                    if img:
+                        # 更新为本地路径
+                        img_tag['src'] = f"assets/{img['filename']}"
+                        img_tag['data-original-src'] = src
+
                 # 保存处理后的HTML
                 with open(html_path, 'w', encoding='utf-8') as f:
                     f.write(str(soup))
 
             # 保存纯文本内容
-            text_content = content.get('text', '')
             if text_content:
                 with open(text_path, 'w', encoding='utf-8') as f:
                     f.write(text_content)
@@ -257,10 +399,10 @@ class ExtractHandler:
             str: 安全的文件名
         """
         # 移除非法字符
-        safe_name = re.sub(r'[\\/*?:"<>|]', '_', text)
+        safe_name = _UNSAFE_CHARS_RE.sub('_', text)
         # 移除多余的空格和下划线
-        safe_name = re.sub(r'\s+', '_', safe_name)
-        safe_name = re.sub(r'_+', '_', safe_name)
+        safe_name = _WHITESPACE_RE.sub('_', safe_name)
+        safe_name = _UNDERSCORES_RE.sub('_', safe_name)
         # 确保文件名不为空
         if not safe_name or safe_name.isspace():
             safe_name = 'untitled'
@@ -292,37 +434,22 @@ class ExtractHandler:
             if img_format not in ['jpg', 'jpeg', 'png', 'gif', 'webp', 'svg']:
                 img_format = 'jpg'  # 默认格式
 
-            # 解码 base64 数据
+            # 保存图片
+            img_path = base_path.with_suffix(f".{img_format}")
+
+            # base64 解码 + 验证 + 转换 + 编码整体在进程池中执行，不阻塞事件循环
             try:
-                binary_data = base64.b64decode(encoded)
-            except Exception as decode_error:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(
+                    _get_image_executor(),
+                    _decode_and_save, encoded, str(img_path), img_format
+                )
+            except binascii.Error as decode_error:
                 logger.error(f"Base64解码失败: {decode_error}")
                 return None
-
-            # 验证图片数据
-            if img_format != 'svg':
-                try:
-                    img = Image.open(io.BytesIO(binary_data))
-                    img.verify()  # 验证图片完整性
-                    # 重新打开以便保存（verify会关闭文件）
-                    img = Image.open(io.BytesIO(binary_data))
-                    # 转换为RGB模式（处理RGBA等情况）
-                    if img.mode in ['RGBA', 'LA'] and img_format == 'jpg':
-                        background = Image.new('RGB', img.size, (255, 255, 255))
-                        background.paste(img, mask=img.split()[3])
-                        img = background
-                except Exception as img_error:
-                    logger.error(f"图片验证失败: {img_error}")
-                    return None
-
-            # 保存图片
-            img_path = base_path.with_suffix(f".{img_format}")
-            
-            if img_format == 'svg':
-                with open(img_path, 'wb') as f:
-                    f.write(binary_data)
-            else:
-                img.save(img_path, format=img_format.upper())
+            except Exception as img_error:
+                logger.error(f"图片验证失败: {img_error}")
+                return None
 
             return img_path
         except Exception as e:
@@ -349,36 +476,49 @@ class ExtractHandler:
             if ext in ['.jpeg', '.jpg']:
                 ext = '.jpg'
 
-            # 下载图片
+            # 保存图片
+            img_path = base_path.with_suffix(ext)
+
+            # 下载图片（aiohttp 异步流式下载，复用连接池，不再阻塞线程池）
             try:
-                response = await asyncio.get_event_loop().run_in_executor(
-                    None, lambda: requests.get(url, timeout=15, stream=True, 
-                                              headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'})
-                )
-                response.raise_for_status()
-            except requests.exceptions.RequestException as req_error:
+                session = await _get_session()
+                async with session.get(
+                    url,
+                    timeout=aiohttp.ClientTimeout(total=15),
+                    headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+                ) as response:
+                    response.raise_for_status()
+
+                    # 检查内容类型
+                    content_type = response.headers.get('Content-Type', '')
+                    if 'image' not in content_type and 'svg' not in content_type:
+                        logger.warning(f"非图片内容类型: {content_type}, URL: {url}")
+                        # 尝试继续处理，因为有些服务器可能返回错误的内容类型
+
+                    # 保存原始图片数据
+                    # Content-Length 已知且不大时一次性读入、单次写出；
+                    # 否则按 256 KiB 分块流式写入（无缓冲直写），
+                    # 比原来的 8 KiB 分块少 ~30 倍系统调用
+                    content_length = response.content_length
+                    if content_length is not None and content_length <= 4 * 1024 * 1024:
+                        data = await response.read()
+                        with open(img_path, 'wb', buffering=0) as f:
+                            f.write(data)
+                    else:
+                        with open(img_path, 'wb', buffering=0) as f:
+                            async for chunk in response.content.iter_chunked(262144):
+                                f.write(chunk)
+            except aiohttp.ClientError as req_error:
                 logger.error(f"图片下载请求失败 {url}: {req_error}")
                 return None
 
-            # 检查内容类型
-            content_type = response.headers.get('Content-Type', '')
-            if 'image' not in content_type and 'svg' not in content_type:
-                logger.warning(f"非图片内容类型: {content_type}, URL: {url}")
-                # 尝试继续处理，因为有些服务器可能返回错误的内容类型
-
-            # 保存图片
-            img_path = base_path.with_suffix(ext)
-            
-            # 保存原始图片数据
-            with open(img_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-
-            # 验证图片（除了SVG）
+            # 验证图片（除了SVG），解码在进程池中执行
             if ext != '.svg':
                 try:
-                    img = Image.open(img_path)
-                    img.verify()  # 验证图片完整性
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(
+                        _get_image_executor(), _verify_image_file, str(img_path)
+                    )
                 except Exception as img_error:
                     logger.error(f"下载的图片验证失败 {url}: {img_error}")
                     if img_path.exists():
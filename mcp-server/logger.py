@@ -7,22 +7,20 @@
 - 统一的日志获取接口
 """
 
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
-from uvicorn.logging import DefaultFormatter, ColourizedFormatter
+from uvicorn.logging import ColourizedFormatter
 from fastapi.logger import logger as fastapi_logger
 
 # 配置日志格式
 log_format = "%(levelprefix)s %(asctime)s | %(message)s"
-log_config = {
-    "handlers": [logging.StreamHandler(sys.stdout)],
-    "format": log_format,
-    "datefmt": "%Y-%m-%d %H:%M:%S",
-    "level": logging.INFO
-}
 
 # 配置彩色输出
-log_config["handlers"][0].setFormatter(
+_handler = logging.StreamHandler(sys.stdout)
+_handler.setFormatter(
     ColourizedFormatter(
         fmt=log_format,
         datefmt="%Y-%m-%d %H:%M:%S",
@@ -30,24 +28,31 @@ log_config["handlers"][0].setFormatter(
     )
 )
 
-# 初始化基础日志配置
-logging.basicConfig(**log_config)
+# 日志经由队列交给后台线程写出，事件循环里的 logger 调用只做一次
+# put_nowait，stdout 的阻塞写不再占用协程时间
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_listener = logging.handlers.QueueListener(_log_queue, _handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)  # 进程退出前冲刷剩余日志
 
-# 配置FastAPI日志，使用uvicorn的日志配置
-fastapi_logger.handlers = logging.getLogger("uvicorn").handlers
+# 只在根日志记录器上挂载处理器，各模块的记录器通过 propagate 继承，
+# 不再遍历 loggerDict 逐个覆盖 handlers（O(N) 且会破坏各记录器的独立配置）
+_root_logger = logging.getLogger()
+_root_logger.setLevel(logging.INFO)
+_root_logger.handlers = [logging.handlers.QueueHandler(_log_queue)]
+
+# FastAPI 日志同样通过传播使用根记录器的处理器
+fastapi_logger.handlers = []
+fastapi_logger.propagate = True
 
-# 确保所有模块使用相同的日志配置
-for _, logger_instance in logging.getLogger().manager.loggerDict.items():
-    if isinstance(logger_instance, logging.Logger):
-        logger_instance.handlers = fastapi_logger.handlers
 
 def get_logger(name: str) -> logging.Logger:
     """获取指定名称的日志记录器
-    
+
     Args:
         name: 日志记录器名称，通常使用__name__
-        
+
     Returns:
         配置好的日志记录器实例
     """
-    return logging.getLogger(name)
\ No newline at end of file
+    return logging.getLogger(name)
@@ -1,4 +1,10 @@
-from typing import  Optional
+from typing import  Dict, Optional, Tuple
+from functools import lru_cache
+import asyncio
+import base64
+import re
+import time
+import orjson
 import uvicorn
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi_mcp import add_mcp_server
@@ -11,6 +17,14 @@ from decorators import validate_connect_id
 
 logger = get_logger(__name__)
 
+# 在导入阶段安装 uvloop 事件循环策略，让外部启动方式
+# （uvicorn CLI、被其他程序导入等）也使用 uvloop；未安装时回退默认循环
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 """
 MCP 工具服务器 - 主模块
 
@@ -28,9 +42,41 @@ app = FastAPI(
     version="1.0.0"
 )
 
+@app.on_event("startup")
+async def _install_eager_task_factory():
+    """启用 eager task factory（Python 3.12+）
+
+    本服务大量创建立即完成或很快挂起的短命协程（缓存命中、参数校验
+    失败、入队即返回等），eager 模式让它们内联执行到第一次挂起点，
+    省掉一轮事件循环调度；旧版本 Python 上自动跳过。
+    """
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+        logger.info("已启用 asyncio eager task factory")
+
 # 创建WebSocket连接管理器实例
 ws_manager = WebSocketManager()
 
+# 浏览器连接ID前缀，预先定义避免每次调用的 f-string 格式化
+_BROWSER_PREFIX = "ws_browser:"
+
+# 从大帧头部快速提取 message_id（字符串或整数两种形态）
+_MESSAGE_ID_RE = re.compile(r'"message_id"\s*:\s*(?:"([^"]*)"|(\d+))')
+
+# 小体积命令消息经常原样重发（同一 ping/状态查询），按原始文本缓存
+# 解析结果，命中时完全跳过 JSON 解析；上层可能改动返回的 dict，
+# 所以每次命中都给浅拷贝
+_PARSE_CACHE_MAX_LEN = 1024
+
+@lru_cache(maxsize=1024)
+def _parse_small_cached(text: str) -> dict:
+    return orjson.loads(text)
+
+def _parse_command(text: str) -> dict:
+    if len(text) < _PARSE_CACHE_MAX_LEN:
+        return dict(_parse_small_cached(text))
+    return orjson.loads(text)
+
 
 def get_browser_conn_id(conn_id: str) -> str:
     """
@@ -44,7 +90,7 @@ def get_browser_conn_id(conn_id: str) -> str:
     返回:
         格式化后的浏览器连接ID
     """
-    return f"ws_browser:{conn_id}"
+    return _BROWSER_PREFIX + conn_id
 
 @app.websocket("/ws_browser")
 @validate_connect_id
@@ -64,19 +110,49 @@ async def websocket_browser(websocket: WebSocket, conn_id: Optional[str] = None)
     conn_id = await ws_manager.connect(websocket, conn_id)
     logger.info(f"浏览器WebSocket连接已建立 [{conn_id}]")
     
+    # 把循环内反复用到的方法绑定为局部变量，省掉每条消息的
+    # 属性链查找（websocket.receive、ws_manager.handle_xxx 等）
+    receive = websocket.receive
+    handle_binary_response = ws_manager.handle_binary_response
+    handle_response = ws_manager.handle_response
+    loads = orjson.loads
+
     try:
         while True:
-            # 接收浏览器发送的消息
-            data = await websocket.receive_json()
-            
+            # 接收浏览器发送的消息（文本帧或二进制帧）
+            frame = await receive()
+            if frame.get("type") == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code") or 1000)
+
+            raw_bytes = frame.get("bytes")
+            if raw_bytes is not None:
+                # 二进制响应帧（截图原始数据），直接按字节头部解析关联
+                await handle_binary_response(raw_bytes)
+                continue
+
+            text = frame.get("text") or ""
+            if len(text) > 4096:
+                # 大文本帧（通常带 base64 图片/提取结果）先用正则从帧头
+                # 拎出 message_id；等待方已超时离开的迟到响应直接丢弃，
+                # 省掉整帧的 JSON 解析
+                match = _MESSAGE_ID_RE.search(text, 0, 2048)
+                if match:
+                    message_id = match.group(1) if match.group(1) is not None else int(match.group(2))
+                    if not ws_manager.has_pending(message_id):
+                        logger.debug("丢弃无等待方的迟到响应: message_id=%s, %d 字节", message_id, len(text))
+                        continue
+
+            # 文本帧走原有的 JSON 路径（orjson 解析比标准库 json 更快）
+            data = loads(text)
+
             # 根据消息类型进行处理
             if "message_id" in data:
                 # 如果是响应消息，则传递给响应处理器
                 logger.info(f"浏览器 [{conn_id}] 发送响应: message_id={data['message_id']}")
-                await ws_manager.handle_response(data)
+                await handle_response(data)
             else:
                 # 处理其他类型的消息（如心跳包等）
-                logger.debug(f"浏览器 [{conn_id}] 发送其他消息: {data}")
+                logger.debug("浏览器 [%s] 发送其他消息: %s", conn_id, data)
     except WebSocketDisconnect:
         # 处理WebSocket断开连接
         logger.info(f"浏览器 [{conn_id}] 断开连接")
@@ -101,16 +177,67 @@ async def websocket_send_command(websocket: WebSocket, conn_id: Optional[str] =
     # 建立WebSocket连接
     conn_id = await ws_manager.connect(websocket, conn_id)
     logger.info(f"命令WebSocket连接已建立 [{conn_id}]")
-    
+
+    # 接收循环只负责入队，实际转发由聚合协程处理
+    command_queue: asyncio.Queue = asyncio.Queue()
+
+    async def _dispatch_command(message: dict):
+        """把单条命令转发给浏览器，并把响应发回命令客户端"""
+        try:
+            # 发送消息到浏览器并等待响应
+            browser_conn_id = get_browser_conn_id(conn_id)
+            logger.info(f"转发命令到浏览器 [{browser_conn_id}]: message_id={message['message_id']}")
+            response = await ws_manager.send_message(message, target_conn_id=browser_conn_id)
+
+            # 将响应发送回客户端
+            logger.info(f"收到浏览器响应并转发回命令客户端 [{conn_id}]")
+            await websocket.send_bytes(orjson.dumps(response))
+        except ConnectionError as e:
+            # 处理连接错误
+            error_msg = {"error": str(e), "status": "error"}
+            logger.error(f"命令执行失败: {str(e)}")
+            await websocket.send_bytes(orjson.dumps(error_msg))
+
+    async def _command_flusher():
+        """聚合短时间内的命令突发
+
+        取到一条命令后等待 1ms 聚合窗口，把窗口内相同 (command, url)
+        的命令去重只留最新一条，避免客户端连发时重复驱动浏览器。
+        """
+        try:
+            while True:
+                batch = [await command_queue.get()]
+                await asyncio.sleep(0.001)
+                while not command_queue.empty():
+                    batch.append(command_queue.get_nowait())
+                if len(batch) > 1:
+                    deduped = {}
+                    for m in batch:
+                        deduped[(m["command"], m["url"])] = m
+                    if len(deduped) < len(batch):
+                        logger.info(f"命令去重: {len(batch)} 条合并为 {len(deduped)} 条")
+                    batch = list(deduped.values())
+                for m in batch:
+                    await _dispatch_command(m)
+        except asyncio.CancelledError:
+            pass  # 连接关闭时被取消
+        except Exception as e:
+            logger.error(f"命令聚合协程异常退出 [{conn_id}]: {str(e)}", exc_info=True)
+
+    flusher_task = asyncio.create_task(_command_flusher())
+
+    # 同浏览器端循环：热路径上的方法绑定为局部变量
+    receive_text = websocket.receive_text
+
     try:
         while True:
-            # 接收客户端发送的命令
-            data = await websocket.receive_json()
+            # 接收客户端发送的命令（小消息走解析缓存，重复命令免解析）
+            data = _parse_command(await receive_text())
             logger.info(f"命令客户端 [{conn_id}] 发送命令: {data.get('command', '未知命令')}, URL: {data.get('url', '')}")
-            
+
             # 验证命令格式
             if "command" in data and "url" in data:
-                # 构造消息并发送给浏览器
+                # 构造消息并放入聚合队列
                 message = {
                     "source": data.get("source","ws_command"),
                     "action": data.get("action", data.get("command")),  # 兼容不同格式
@@ -119,26 +246,12 @@ async def websocket_send_command(websocket: WebSocket, conn_id: Optional[str] =
                     "fullPage": data.get("fullPage", False),
                     "message_id": data.get("message_id", "")
                 }
-                
-                try:
-                    # 发送消息到浏览器并等待响应
-                    browser_conn_id = get_browser_conn_id(conn_id)
-                    logger.info(f"转发命令到浏览器 [{browser_conn_id}]: message_id={message['message_id']}")
-                    response = await ws_manager.send_message(message, target_conn_id=browser_conn_id)
-                    
-                    # 将响应发送回客户端
-                    logger.info(f"收到浏览器响应并转发回命令客户端 [{conn_id}]")
-                    await websocket.send_json(response)
-                except ConnectionError as e:
-                    # 处理连接错误
-                    error_msg = {"error": str(e), "status": "error"}
-                    logger.error(f"命令执行失败: {str(e)}")
-                    await websocket.send_json(error_msg)
+                command_queue.put_nowait(message)
             else:
                 # 处理格式错误的命令
                 error_msg = {"error": "无效的命令格式，需要包含 'command' 和 'url' 字段", "status": "error"}
                 logger.warning(f"收到格式错误的命令: {data}")
-                await websocket.send_json(error_msg)
+                await websocket.send_bytes(orjson.dumps(error_msg))
     except WebSocketDisconnect:
         # 处理WebSocket断开连接
         logger.info(f"命令客户端 [{conn_id}] 断开连接")
@@ -147,6 +260,8 @@ async def websocket_send_command(websocket: WebSocket, conn_id: Optional[str] =
         # 处理其他异常
         logger.error(f"命令WebSocket连接 [{conn_id}] 发生异常: {str(e)}")
         ws_manager.disconnect(conn_id)
+    finally:
+        flusher_task.cancel()
 
 # 配置并添加MCP服务器
 mcp_server = add_mcp_server(
@@ -157,17 +272,40 @@ mcp_server = add_mcp_server(
     describe_full_response_schema=True  # 在工具描述中包含完整的JSON模式
 )
 
+# screenshot 结果的短 TTL 缓存：agent 经常对同一 URL 连续调用截图，
+# 命中时直接返回上次的 base64 数据，省掉整个浏览器往返；
+# 每个缓存键一把锁，让并发的相同请求合并为一次浏览器抓取
+_SHOT_CACHE_TTL = 30.0
+_shot_cache: Dict[str, Tuple[float, str]] = {}
+_shot_locks: Dict[str, asyncio.Lock] = {}
+
+def _prune_shot_cache(now: float):
+    """清理过期的截图缓存条目及其锁
+
+    过期条目只在下次同键截图时才会被覆盖，不清理的话每个访问过的
+    URL 都会把几 MB 的 base64 字符串和一把锁钉在内存里；这里在每次
+    调用前把过期键连同无人持有的孤儿锁一并回收，字典大小始终只随
+    TTL 窗口内的活跃 URL 数增长。
+    """
+    for key in [k for k, entry in _shot_cache.items() if now - entry[0] >= _SHOT_CACHE_TTL]:
+        _shot_cache.pop(key, None)
+    # 没有对应缓存条目且当前空闲的锁一并回收；极小的竞态窗口下
+    # 最坏结果是同一 URL 多截一次图，不影响正确性
+    for key in [k for k, lock in _shot_locks.items() if k not in _shot_cache and not lock.locked()]:
+        _shot_locks.pop(key, None)
+
 @mcp_server.tool()
 async def screenshot(url: str, fullPage=False) -> str:
     """
     捕获指定URL的网页截图
-    
-    通过浏览器扩展捕获指定URL的网页截图，并返回Base64编码的图片数据
-    
+
+    通过浏览器扩展捕获指定URL的网页截图，并返回Base64编码的图片数据；
+    同一URL在30秒内的重复调用直接返回缓存结果
+
     参数:
         url: 要截图的网页URL
         fullPage: 是否捕获整个页面，默认为False
-        
+
     返回:
         Base64编码的图片数据字符串
     """
@@ -176,28 +314,53 @@ async def screenshot(url: str, fullPage=False) -> str:
     if not conn_id:
         logger.error("未配置浏览器连接ID，无法执行截图操作")
         return "未获取到浏览器连接ID，请检查配置"
-        
-    try:
-        # 构造截图命令并发送到浏览器
-        logger.info(f"执行网页截图: {url}")
-        response = await ws_manager.send_message({
-            "source": "mcp_client",
-            "action": "mcp_request", 
-            "command": "capture", 
-            "url": url,
-            "fullPage": fullPage,
-        }, target_conn_id=conn_id)
-        
-        # 检查响应中是否包含图片数据
-        if response.get("result", {}).get("imageData", ""):
-            logger.info(f"成功获取网页截图: {url}")
-            return response.get("result", {}).get("imageData", "")
-        else:
+
+    # 全页截图与视口截图分开缓存；先清掉过期条目防止缓存无限增长
+    now = time.monotonic()
+    _prune_shot_cache(now)
+    cache_key = f"{url}|{bool(fullPage)}"
+    entry = _shot_cache.get(cache_key)
+    if entry and now - entry[0] < _SHOT_CACHE_TTL:
+        logger.info(f"截图缓存命中: {url}")
+        return entry[1]
+
+    lock = _shot_locks.setdefault(cache_key, asyncio.Lock())
+    async with lock:
+        # 等锁期间可能已有并发调用完成了同一 URL 的截图
+        entry = _shot_cache.get(cache_key)
+        if entry and time.monotonic() - entry[0] < _SHOT_CACHE_TTL:
+            logger.info(f"截图缓存命中: {url}")
+            return entry[1]
+
+        try:
+            # 构造截图命令并发送到浏览器
+            logger.info(f"执行网页截图: {url}")
+            response = await ws_manager.send_message({
+                "source": "mcp_client",
+                "action": "mcp_request",
+                "command": "capture",
+                "url": url,
+                "fullPage": fullPage,
+            }, target_conn_id=conn_id)
+
+            # 检查响应中是否包含图片数据
+            result = response.get("result", {})
+            image_bytes = result.get("imageBytes")
+            if image_bytes is not None:
+                # 二进制帧路径：只在 MCP 边界做一次 base64 编码
+                logger.info(f"成功获取网页截图(二进制帧): {url}")
+                image_data = base64.b64encode(image_bytes).decode("ascii")
+            else:
+                image_data = result.get("imageData", "")
+            if image_data:
+                # 只缓存成功结果，失败和空响应照常直通
+                _shot_cache[cache_key] = (time.monotonic(), image_data)
+                return image_data
             logger.warning(f"截图响应中未包含图片数据: {response}")
             return ""
-    except ConnectionError as e:
-        logger.error(f"截图操作失败: {str(e)}")
-        return f"截图失败: {str(e)}"
+        except ConnectionError as e:
+            logger.error(f"截图操作失败: {str(e)}")
+            return f"截图失败: {str(e)}"
 
 @mcp_server.tool()
 async def extract(url: str ) -> str:
@@ -251,34 +414,78 @@ async def add(a: int, b: int) -> int:
         两个数字的和
     """
     result = a + b
-    logger.debug(f"计算: {a} + {b} = {result}")
+    logger.debug("计算: %s + %s = %s", a, b, result)
     return result
 
+# get_server_time 的时间戳字符串缓存：100ms 粒度内复用同一字符串，
+# 高频轮询时省掉 datetime 对象分配和格式化
+_iso_now_cache = ["", 0.0]
+
+def _cached_iso_now() -> str:
+    now = time.monotonic()
+    if now - _iso_now_cache[1] >= 0.1 or not _iso_now_cache[0]:
+        _iso_now_cache[0] = datetime.now().isoformat()
+        _iso_now_cache[1] = now
+    return _iso_now_cache[0]
+
 @mcp_server.tool()
 async def get_server_time() -> str:
     """
     获取服务器当前时间
-    
+
     返回:
         ISO格式的服务器当前时间字符串
     """
-    current_time = datetime.now().isoformat()
-    logger.debug(f"获取服务器时间: {current_time}")
+    current_time = _cached_iso_now()
+    logger.debug("获取服务器时间: %s", current_time)
     return current_time
 
 
+# ---- MCP 工具列表缓存 ----
+# MCP 客户端（Claude/Cline 等）在每次 LLM 调用前都会发送 ListTools 请求，
+# 而工具集在启动后不会变化，没有必要每次都重新做 JSON Schema 内省。
+# 用带 TTL 的缓存包装底层的 list_tools 处理器；所有工具都已在上面注册完毕，
+# 运行期间不会再新增，因此无需主动失效。
+_TOOLS_CACHE_TTL = 300.0  # 秒
+_tools_cache = None  # (过期时间戳, 工具列表)
+
+
+async def _cached_list_tools():
+    global _tools_cache
+    now = time.monotonic()
+    if _tools_cache and now < _tools_cache[0]:
+        return _tools_cache[1]
+    tools = await mcp_server.list_tools()
+    _tools_cache = (now + _TOOLS_CACHE_TTL, tools)
+    return tools
+
+
+try:
+    # FastMCP 在初始化时已向底层 Server 绑定了自己的 list_tools，
+    # 这里重新注册为缓存版本
+    mcp_server._mcp_server.list_tools()(_cached_list_tools)
+except AttributeError:
+    logger.warning("无法安装 MCP 工具列表缓存（fastapi_mcp 内部结构变化），已跳过")
+
 
 if __name__ == "__main__":
     # 打印所有注册的路由信息（仅在调试模式下）
     if settings.debug:
         for route in app.routes:
-            logger.debug(f"注册路由: {route.path} - {route.name}")
+            logger.debug("注册路由: %s - %s", route.path, route.name)
 
-    # 启动服务器
+    # 启动服务器（使用 uvloop 事件循环，WebSocket 密集型场景下吞吐量更高）
     logger.info(f"启动MCP工具服务器 - 监听: {settings.host}:{settings.port}")
+    # 连接状态（active_connections/pending_responses）保存在进程内，
+    # 因此保持单 worker；协议解析选用 C 实现（httptools/websockets）
     uvicorn.run(
         app,
         host=settings.host,
         port=settings.port,
+        loop="uvloop",
+        http="httptools",
+        ws="websockets",
+        # 截图/图片负载基本是高熵数据，permessage-deflate 压不动还白烧 CPU
+        ws_per_message_deflate=False,
         log_level="info"
     )
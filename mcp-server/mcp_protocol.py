@@ -6,9 +6,13 @@ MCP 工具 - MCP 协议处理
 负责处理 MCP 协议的消息格式和指令处理
 """
 
-import json
+import asyncio
+import collections
 import logging
-import uuid
+import time
+import orjson
+import secrets
+import zlib
 from datetime import datetime
 
 # 导入处理器
@@ -22,6 +26,14 @@ logger = logging.getLogger('mcp_protocol')
 class MCPProtocol:
     """MCP 协议处理类，负责处理 MCP 协议的消息格式和指令处理"""
 
+    # 单客户端出站队列长度上限，塞满说明该客户端消费不过来
+    OUTBOUND_QUEUE_SIZE = 256
+    # 写协程单帧最多聚合的消息条数/字节数，保证延迟有界
+    MAX_WRITE_BATCH = 32
+    MAX_WRITE_BATCH_BYTES = 64 * 1024
+    # 广播负载超过该大小时预压缩一次，所有连接共享压缩结果
+    BROADCAST_COMPRESS_MIN = 4096
+
     def __init__(self, server):
         """初始化 MCP 协议处理器
 
@@ -33,6 +45,93 @@ class MCPProtocol:
             'capture': CaptureHandler(server),
             'extract': ExtractHandler(server)
         }
+        # 消息类型 -> 处理方法的派发表，热路径一次 dict 查找替代逐个 if/elif
+        self._dispatch = {
+            'command': self.handle_command,
+            'response': self.handle_response,
+            'ping': self.handle_ping,
+        }
+        # 时间戳字符串缓存，见 _now_iso
+        self._now_iso_cache = ''
+        self._now_iso_stamp = 0.0
+        # 广播用的每客户端出站队列和后台写协程
+        self._out_queues = {}
+        self._writer_tasks = {}
+        # 固定文案错误消息的序列化结果缓存，见 send_error
+        self._error_payload_cache = {}
+
+    def _ensure_writer(self, client_id, websocket):
+        """确保客户端有出站队列和后台写协程，返回队列"""
+        queue = self._out_queues.get(client_id)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.OUTBOUND_QUEUE_SIZE)
+            self._out_queues[client_id] = queue
+            self._writer_tasks[client_id] = asyncio.create_task(
+                self._client_writer(client_id, websocket, queue)
+            )
+        return queue
+
+    async def _client_writer(self, client_id, websocket, queue):
+        """客户端的后台写协程
+
+        取到首条消息后非阻塞吸干队列中已排队的消息，多条时拼成一个
+        JSON 数组帧一次发送，把帧头和系统调用开销摊到整批上；
+        批量受条数和字节数双重上限约束，单条消息保持原帧格式不变。
+        """
+        try:
+            while True:
+                payload = await queue.get()
+                # 0x01 开头是预压缩帧，不能拼进 JSON 数组，单独成帧
+                if payload[:1] == b'\x01':
+                    await websocket.send(payload)
+                    continue
+                batch = [payload]
+                size = len(payload)
+                tail = None
+                while (len(batch) < self.MAX_WRITE_BATCH
+                       and size < self.MAX_WRITE_BATCH_BYTES
+                       and not queue.empty()):
+                    item = queue.get_nowait()
+                    if item[:1] == b'\x01':
+                        tail = item  # 压缩帧到此截断批量，随后单独发送
+                        break
+                    batch.append(item)
+                    size += len(item)
+                if len(batch) == 1:
+                    await websocket.send(payload)
+                else:
+                    # 各条已是序列化好的 JSON bytes，拼成数组帧即可，
+                    # 客户端收到顶层数组时按条展开处理
+                    await websocket.send(b'[' + b','.join(batch) + b']')
+                if tail is not None:
+                    await websocket.send(tail)
+        except asyncio.CancelledError:
+            pass  # 客户端断开时被取消
+        except Exception as e:
+            logger.error(f"客户端 {client_id} 的写协程异常退出: {e}")
+
+    def drop_client_writer(self, client_id):
+        """客户端断开时清理其出站队列和写协程"""
+        self._out_queues.pop(client_id, None)
+        task = self._writer_tasks.pop(client_id, None)
+        if task:
+            task.cancel()
+
+    def _now_iso(self):
+        """返回缓存的 ISO 格式当前时间字符串
+
+        datetime.now().isoformat() 每次都要分配 datetime 对象再格式化，
+        ping/错误这类高频路径没必要每条消息都付这份开销；这里按
+        100ms 粒度惰性刷新，精度足够消息打点使用。
+
+        Returns:
+            str: ISO 格式时间字符串
+        """
+        now = time.monotonic()
+        if now - self._now_iso_stamp >= 0.1 or not self._now_iso_cache:
+            self._now_iso_cache = datetime.now().isoformat()
+            self._now_iso_stamp = now
+        return self._now_iso_cache
 
     async def handle_message(self, client_id, message):
         """处理客户端消息
@@ -42,20 +141,17 @@ class MCPProtocol:
             message (dict): 消息内容
         """
         message_type = message.get('type')
-        
+
         if not message_type:
             await self.send_error(client_id, "消息缺少 'type' 字段")
             return
 
-        # 根据消息类型处理
-        if message_type == 'command':
-            await self.handle_command(client_id, message)
-        elif message_type == 'response':
-            await self.handle_response(client_id, message)
-        elif message_type == 'ping':
-            await self.handle_ping(client_id, message)
-        else:
+        # 根据消息类型派发处理
+        handler = self._dispatch.get(message_type)
+        if handler is None:
             await self.send_error(client_id, f"未知的消息类型: {message_type}")
+            return
+        await handler(client_id, message)
 
     async def handle_command(self, client_id, message):
         """处理命令消息
@@ -65,13 +161,13 @@ class MCPProtocol:
             message (dict): 命令消息
         """
         command = message.get('command')
-        command_id = message.get('id') or str(uuid.uuid4())
+        command_id = message.get('id') or secrets.token_hex(16)
         
         if not command:
             await self.send_error(client_id, "命令消息缺少 'command' 字段", command_id)
             return
 
-        logger.info(f"收到客户端 {client_id} 的命令: {command} (ID: {command_id})")
+        logger.info("收到客户端 %s 的命令: %s (ID: %s)", client_id, command, command_id)
 
         # 检查命令处理器是否存在
         if command not in self.handlers:
@@ -94,7 +190,15 @@ class MCPProtocol:
 
         # 将任务添加到客户端的任务列表
         if client_id in self.server.clients:
-            self.server.clients[client_id]['tasks'].append(command_id)
+            client = self.server.clients[client_id]
+            # 旧结构是随连接存活无限增长的 list；首次使用时转换为
+            # 有界 deque（超出后自然淘汰最旧任务）并维护一个 set
+            # 提供 O(1) 成员判断
+            if not isinstance(client.get('tasks'), collections.deque):
+                client['tasks'] = collections.deque(client.get('tasks') or (), maxlen=4096)
+                client['task_set'] = set(client['tasks'])
+            client['tasks'].append(command_id)
+            client['task_set'].add(command_id)
 
         # 添加到任务队列
         await self.server.task_queue.add_task(task)
@@ -107,6 +211,19 @@ class MCPProtocol:
             'message': f"命令 {command} 已接收，正在处理"
         })
 
+    def remove_task(self, client_id, command_id):
+        """任务完成后从客户端任务集中移除
+
+        只清理 task_set，deque 中的记录由 maxlen 自然淘汰。
+
+        Args:
+            client_id (str): 客户端 ID
+            command_id (str): 任务 ID
+        """
+        client = self.server.clients.get(client_id)
+        if client:
+            client.get('task_set', set()).discard(command_id)
+
     async def handle_response(self, client_id, message):
         """处理响应消息
 
@@ -121,7 +238,7 @@ class MCPProtocol:
             await self.send_error(client_id, "响应消息缺少必要字段")
             return
 
-        logger.info(f"收到客户端 {client_id} 的响应: {command} (ID: {response_id})")
+        logger.info("收到客户端 %s 的响应: %s (ID: %s)", client_id, command, response_id)
 
         # 通知相应的处理器
         if command in self.handlers:
@@ -137,7 +254,7 @@ class MCPProtocol:
         # 回复 pong 消息
         await self.send_message(client_id, {
             'type': 'pong',
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': self._now_iso(),
             'server_status': self.server.get_server_status()
         })
 
@@ -154,28 +271,108 @@ class MCPProtocol:
 
         websocket = self.server.clients[client_id]['websocket']
         try:
-            await websocket.send(json.dumps(message))
+            # orjson 序列化更快，返回 bytes，websockets 按二进制帧发送
+            try:
+                payload = orjson.dumps(message)
+            except TypeError:
+                # 消息里混入非 JSON 原生类型（如 datetime、Path）时退回
+                # 字符串化兜底，不让单条消息毁掉整个发送路径
+                payload = orjson.dumps(message, default=str)
+            await websocket.send(payload)
+        except Exception as e:
+            logger.error(f"向客户端 {client_id} 发送消息失败: {e}")
+
+    async def broadcast_message(self, message, exclude_client_id=None):
+        """向所有已连接客户端广播消息
+
+        负载只做一次 orjson 序列化，同一个 bytes 对象复用给所有连接，
+        避免 N 个客户端就编码 N 次。入队即返回（fire-and-forget），
+        实际发送由每个客户端的后台写协程完成，广播方不再被最慢的
+        客户端拖住；队列塞满说明客户端消费不过来，该条消息对它丢弃。
+
+        Args:
+            message (dict): 消息内容
+            exclude_client_id (str, optional): 要跳过的客户端 ID
+        """
+        if not self.server.clients:
+            return
+
+        try:
+            payload = orjson.dumps(message)
+        except TypeError:
+            payload = orjson.dumps(message, default=str)
+
+        if len(payload) > self.BROADCAST_COMPRESS_MIN:
+            # 大负载（截图、HTML 块）只压缩这一次，替代每连接各自
+            # deflate 的开销；帧首字节 0x01 标记 zlib 压缩，客户端
+            # 先解压再按 JSON 处理。未压缩的 JSON 帧首字节只会是
+            # '{' 或 '['，不会冲突；压不小的负载保持原样
+            compressed = zlib.compress(payload, 1)
+            if len(compressed) < len(payload):
+                payload = b'\x01' + compressed
+
+        # 显式取一次元组快照：注册/注销不会影响本轮遍历，
+        # 排除判断也挪到循环外，入队循环里只剩直线代码
+        if exclude_client_id is None:
+            snapshot = tuple(self.server.clients.items())
+        else:
+            snapshot = tuple(
+                item for item in self.server.clients.items()
+                if item[0] != exclude_client_id
+            )
+        for client_id, client in snapshot:
+            queue = self._ensure_writer(client_id, client['websocket'])
+            try:
+                queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                logger.warning(f"客户端 {client_id} 出站队列已满，丢弃本条广播")
+
+    async def _send_payload(self, client_id, payload):
+        """向客户端发送已序列化好的 bytes 负载"""
+        client = self.server.clients.get(client_id)
+        if client is None:
+            logger.warning("尝试向不存在的客户端 %s 发送消息", client_id)
+            return
+        try:
+            await client['websocket'].send(payload)
         except Exception as e:
             logger.error(f"向客户端 {client_id} 发送消息失败: {e}")
 
     async def send_error(self, client_id, message, command_id=None):
         """向客户端发送错误消息
 
+        错误文案来自一小组固定字符串，不带 command_id 时按
+        (文案, 时间戳) 复用序列化好的 bytes，高频错误路径免去
+        重复的 JSON 编码。
+
         Args:
             client_id (str): 客户端 ID
             message (str): 错误消息
             command_id (str, optional): 相关命令 ID
         """
-        error_message = {
+        timestamp = self._now_iso()
+
+        if not command_id:
+            key = (message, timestamp)
+            payload = self._error_payload_cache.get(key)
+            if payload is None:
+                if len(self._error_payload_cache) > 256:
+                    self._error_payload_cache.clear()  # 文案集合很小，粗暴清空即可
+                payload = orjson.dumps({
+                    'type': 'error',
+                    'message': message,
+                    'timestamp': timestamp
+                })
+                self._error_payload_cache[key] = payload
+            await self._send_payload(client_id, payload)
+            return
+
+        await self.send_message(client_id, {
             'type': 'error',
             'message': message,
-            'timestamp': datetime.now().isoformat()
-        }
-
-        if command_id:
-            error_message['id'] = command_id
-
-        await self.send_message(client_id, error_message)
+            'timestamp': timestamp,
+            'id': command_id
+        })
 
     def validate_api_key(self, api_key):
         """验证 API 密钥
@@ -7,9 +7,12 @@ MCP 工具 - WebSocketManager
 """
 
 from typing import Set, Dict, Optional
-import uuid
+import secrets
 import asyncio
+from collections import defaultdict
+from itertools import count
 
+import orjson
 from fastapi import WebSocket
 from config import settings
 
@@ -18,25 +21,97 @@ from logger import get_logger
 logger = get_logger(__name__)
 
 class WebSocketManager:
+    # 单个批量帧最多合并的消息数，避免批次无限增长
+    MAX_BATCH_SIZE = 128
+    # 待响应表的分片数（2 的幂），高并发下减小单个 dict 的体积和扩容抖动
+    PENDING_SHARDS = 16
+
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}  # {conn_id: websocket}
-        self.pending_responses: Dict[str, asyncio.Future] = {}  # 存储待响应的 Future
+        # 按 message_id 哈希分片的待响应 Future 表
+        self.pending_responses = [{} for _ in range(self.PENDING_SHARDS)]
+        self.send_queues: Dict[str, asyncio.Queue] = {}  # {conn_id: 发送队列}
+        self._writer_tasks: Dict[str, asyncio.Task] = {}  # {conn_id: 后台写协程}
+        self._default_conn_id: Optional[str] = None  # 未指定目标时使用的默认连接
+        self.conn_pending: Dict[str, set] = defaultdict(set)  # {conn_id: 该连接在途的 message_id}
+        self.conn_sem: Dict[str, asyncio.Semaphore] = {}  # {conn_id: 在途请求限流信号量}
+        # 进程内单调递增的消息 ID 生成器，比 uuid4 快两个数量级且不读系统熵
+        self._next_message_id = count(1).__next__
+
+    def _pending_shard(self, message_id) -> Dict[str, asyncio.Future]:
+        """按 message_id（int 或 str）哈希取对应的待响应分片"""
+        return self.pending_responses[hash(message_id) & (self.PENDING_SHARDS - 1)]
+
+    def has_pending(self, message_id) -> bool:
+        """是否还有等待方在等待该 message_id 的响应"""
+        return message_id in self._pending_shard(message_id)
 
     async def connect(self, websocket: WebSocket, conn_id: Optional[str] = None) -> str:
         logger.debug("正在接受 WebSocket 连接...")
+        # 无需手动关 Nagle：asyncio/uvloop 对 TCP 传输默认就开 TCP_NODELAY，
+        # 且 uvicorn 的 ASGI scope 并不暴露底层 socket
         await websocket.accept()
-        conn_id = conn_id or str(uuid.uuid4())  # 如果没有提供 conn_id，则生成一个
+        # 如果没有提供 conn_id，则生成一个；token_hex 比 uuid4 少一次
+        # UUID 对象构造和带连字符的格式化，连接风暴下更省
+        conn_id = conn_id or secrets.token_hex(16)
         self.active_connections[conn_id] = websocket
+        # 每个连接一个发送队列和后台写协程，同一时刻排队的多条消息会合并为一帧发送
+        queue: asyncio.Queue = asyncio.Queue()
+        self.send_queues[conn_id] = queue
+        self._writer_tasks[conn_id] = asyncio.create_task(
+            self._connection_writer(conn_id, websocket, queue)
+        )
+        # 限制单连接在途请求数：浏览器端处理不过来时，新调用在信号量上
+        # 排队等待，而不是无限堆积 Future 把内存撑爆
+        self.conn_sem[conn_id] = asyncio.Semaphore(settings.max_inflight_per_connection)
+        if self._default_conn_id is None:
+            self._default_conn_id = conn_id
         logger.info(f"新连接建立，conn_id: {conn_id}")
-        logger.debug(f"当前连接数: {len(self.active_connections)}")
+        logger.debug("当前连接数: %d", len(self.active_connections))
         return conn_id
 
     def disconnect(self, conn_id: str):
-        logger.debug(f"正在断开 WebSocket 连接..., 当前连接数: {len(self.active_connections)}")
+        logger.debug("正在断开 WebSocket 连接..., 当前连接数: %d", len(self.active_connections))
         if conn_id in self.active_connections:
             self.active_connections.pop(conn_id)
             logger.info(f"连接断开，conn_id: {conn_id}")
-        logger.debug(f"已断开 WebSocket 连接，当前连接数: {len(self.active_connections)}")
+        self.send_queues.pop(conn_id, None)
+        self.conn_sem.pop(conn_id, None)
+        writer_task = self._writer_tasks.pop(conn_id, None)
+        if writer_task:
+            writer_task.cancel()
+        # 默认连接断开时，重新选取一个（没有连接则置空）
+        if conn_id == self._default_conn_id:
+            self._default_conn_id = next(iter(self.active_connections), None)
+        # 只让本连接的在途请求立即失败，其他连接的请求不受影响，
+        # 等待方无需干等超时
+        for message_id in self.conn_pending.pop(conn_id, ()):
+            future = self._pending_shard(message_id).pop(message_id, None)
+            if future and not future.done():
+                future.set_exception(ConnectionError("连接已断开"))
+        logger.debug("已断开 WebSocket 连接，当前连接数: %d", len(self.active_connections))
+
+    async def _connection_writer(self, conn_id: str, websocket: WebSocket, queue: asyncio.Queue):
+        """连接的后台写协程
+
+        从发送队列中取出消息，把同一时刻已排队的多条消息合并为一个
+        {"batch": [...]} 帧发送，减少小帧的系统调用和 TCP 开销；
+        队列中只有单条消息时保持原有的单消息帧格式。
+        """
+        try:
+            while True:
+                batch = [await queue.get()]
+                while len(batch) < self.MAX_BATCH_SIZE and not queue.empty():
+                    batch.append(queue.get_nowait())
+                if len(batch) == 1:
+                    await websocket.send_bytes(orjson.dumps(batch[0]))
+                else:
+                    logger.debug("合并发送 %d 条消息到连接 [%s]", len(batch), conn_id)
+                    await websocket.send_bytes(orjson.dumps({"batch": batch}))
+        except asyncio.CancelledError:
+            pass  # 连接断开时被取消，属于正常流程
+        except Exception as e:
+            logger.error(f"连接 [{conn_id}] 的写协程异常退出: {str(e)}", exc_info=True)
 
     async def send_message(
         self, 
@@ -49,43 +124,99 @@ class WebSocketManager:
         """
         if not self.active_connections:
             raise ConnectionError("没有活动的 WebSocket 连接")
-        logger.debug(f"正在发送消息, target_conn_id: {target_conn_id}, message: {message}")
+        logger.debug("正在发送消息, target_conn_id: %s, message: %s", target_conn_id, message)
 
-        # 如果没有指定 conn_id，默认选择第一个连接
-        websocket = (
-            self.active_connections.get(target_conn_id)
-            if target_conn_id
-            else next(iter(self.active_connections.values()))
-        )
+        # 如果没有指定 conn_id：单连接时直接用缓存的默认连接；
+        # 多连接时选择在途请求最少的连接，避免负载总压在第一个连接上
+        if target_conn_id:
+            conn_id = target_conn_id
+        elif len(self.active_connections) <= 1:
+            conn_id = self._default_conn_id
+        else:
+            conn_id = min(
+                self.active_connections,
+                key=lambda c: len(self.conn_pending.get(c, ()))
+            )
+        send_queue = self.send_queues.get(conn_id)
+
+        if send_queue is None:
+            raise ConnectionError(f"未找到目标连接: {target_conn_id}")
 
-        if not websocket:
+        sem = self.conn_sem.get(conn_id)
+        if sem is None:
             raise ConnectionError(f"未找到目标连接: {target_conn_id}")
 
         if not message.get("message_id", ""):
-            # 如果消息中未包含 message_id, 则生产一个
-            message_id = str(uuid.uuid4())
+            # 如果消息中未包含 message_id, 则用单调计数器生成一个
+            message_id = self._next_message_id()
             message["message_id"] = message_id  # 加入唯一消息 ID
         else:
             message_id = message["message_id"]
 
-        logger.debug(f"new message: {message}")
-        future = asyncio.get_event_loop().create_future()
-        self.pending_responses[message_id] = future
+        logger.debug("new message: %s", message)
+        # 信号量把单连接的在途请求数压在上限内，超过时调用方在这里
+        # 自然排队（背压），而不是继续分配 Future
+        async with sem:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending_shard(message_id)[message_id] = future
+            self.conn_pending[conn_id].add(message_id)
 
-        try:
-            await websocket.send_json(message)
-            response = await asyncio.wait_for(future, timeout=settings.websocket_timeout)
-            return response
-        except asyncio.TimeoutError:
-            raise ConnectionError("等待响应超时")
-        finally:
-            self.pending_responses.pop(message_id, None)
+            # 直接用 call_later 在 Future 上挂一个超时回调，比 asyncio.timeout
+            # 上下文管理器少一层 CancelScope 的进出开销；正常响应路径只多一次
+            # handle.cancel()
+            def _on_timeout():
+                if not future.done():
+                    future.set_exception(ConnectionError("等待响应超时"))
+
+            timeout_handle = loop.call_later(settings.websocket_timeout, _on_timeout)
+            try:
+                # 放入发送队列，由连接的写协程负责合并发送
+                send_queue.put_nowait(message)
+                return await future
+            finally:
+                timeout_handle.cancel()
+                self._pending_shard(message_id).pop(message_id, None)
+                pending_set = self.conn_pending.get(conn_id)
+                if pending_set is not None:
+                    pending_set.discard(message_id)
+
+    async def handle_binary_response(self, raw: bytes):
+        """处理浏览器以二进制帧返回的响应（如截图的原始 PNG 数据）
+
+        帧格式：2 字节大端 message_id 长度 + message_id(UTF-8) + 原始负载。
+        相比 base64-in-JSON，线上传输量减少约 1/3，且两侧都省去一次
+        base64 编解码和 JSON 解析；负载以 bytes 形式放在
+        result.imageBytes 中交给等待方。
+        """
+        if len(raw) < 2:
+            logger.warning("收到无法解析的二进制响应帧：长度不足")
+            return
+        id_len = int.from_bytes(raw[:2], "big")
+        if len(raw) < 2 + id_len:
+            logger.warning("收到无法解析的二进制响应帧：message_id 不完整")
+            return
+        message_id = raw[2:2 + id_len].decode("utf-8")
+        # 服务器生成的消息 ID 是整数，二进制头部以文本承载，这里还原类型
+        if message_id.isdigit():
+            message_id = int(message_id)
+        payload = raw[2 + id_len:]
+        logger.debug("收到二进制响应: message_id=%s, 负载 %d 字节", message_id, len(payload))
+        shard = self._pending_shard(message_id)
+        if message_id in shard:
+            future = shard[message_id]
+            if not future.done():
+                future.set_result({
+                    "message_id": message_id,
+                    "result": {"imageBytes": payload}
+                })
 
     async def handle_response(self, data: dict):
         """处理 Postman 返回的响应"""
         message_id = data.get("message_id")
-        logger.debug(f"开始响应: {data}, pending_responses: {self.pending_responses}")
-        if message_id in self.pending_responses:
-            future = self.pending_responses[message_id]
+        shard = self._pending_shard(message_id)
+        logger.debug("开始响应: %s, 待响应数: %d", data, sum(map(len, self.pending_responses)))
+        if message_id in shard:
+            future = shard[message_id]
             if not future.done():
                 future.set_result(data)  # 通知 `send_message` 已收到响应
\ No newline at end of file